@@ -1,9 +1,97 @@
+import math
+import time
 import streamlit as st
+import pandas as pd
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from data_utils import load_data, calculate_dataframe, save_data
+from typing import Dict
+from data_utils import load_data, calculate_dataframe, save_data, append_rows, CALC_INPUT_COLS
 from pdf_exporter import EstimatePDFGenerator
 
+# 明細エディタに表示する列
+DISPLAY_COLS = [
+    '確認', '大項目', '中項目', '名称', '規格', '数量', '単位',
+    'NET', '原単価', '掛率', '売単価', '見積金額', '(自)荒利率', '備考', 'sort_key'
+]
+
+@st.cache_data(ttl=300, show_spinner=False)
+def _load_data_cached(sheet_url: str, _secrets: Dict):
+    """シート読込をURL単位でキャッシュする（secretsはキャッシュキーに含めない）。取得した時刻も一緒に返す"""
+    df, info = load_data(sheet_url, _secrets)
+    return df, info, time.monotonic()
+
+@st.cache_resource
+def _service_account() -> Dict:
+    """サービスアカウント情報はプロセスで一度だけ dict にして使い回す"""
+    return dict(st.secrets["gcp_service_account"])
+
+@st.cache_data(max_entries=1, show_spinner=False)
+def _build_pdf(df: pd.DataFrame, params_items: tuple) -> bytes:
+    """明細と現場情報が前回と同じならPDFを作り直さない"""
+    return EstimatePDFGenerator(df, dict(params_items)).generate().getvalue()
+
+def _save_executor() -> ThreadPoolExecutor:
+    """保存はセッションごとのワーカー1本で順番に実行する（自分の書き込みは前後せず、他のユーザーの保存は待たない）"""
+    if 'save_executor' not in st.session_state:
+        st.session_state.save_executor = ThreadPoolExecutor(max_workers=1)
+    return st.session_state.save_executor
+
+@st.fragment(run_every=1)
+def _watch_save():
+    """バックグラウンド保存の完了を待ち、終わったら結果を残してアプリ全体を再実行する"""
+    fut = st.session_state.save_future
+    if fut is None: return
+    if not fut.done():
+        st.info("Google Sheetsへ書き込み中...")
+        return
+    st.session_state.save_future = None
+    if fut.result():
+        # 次回の読み込みで保存後のシートを取得し直す
+        _load_data_cached.clear()
+        st.session_state.save_msg = ('success', "保存しました！")
+    else:
+        # どこまで書けたか分からないので、次回はシートを消してから全体を書き直す
+        st.session_state.dirty_rows = None
+        st.session_state.saved_len = 0
+        st.session_state.save_msg = ('error', "保存に失敗しました。")
+    st.rerun()
+
+def _apply_rate_change(s_key: str):
+    """諸経費率の変更をレートマップに反映して再計算する（スクリプト実行前に済むので st.rerun は不要）"""
+    new_rate = st.session_state[f"rate_input_{s_key}"]
+    # 浮動小数の表記ゆれで再計算が走らないよう許容誤差つきで比較する
+    if math.isclose(new_rate, st.session_state.overhead_rates_map.get(s_key, 0.0), abs_tol=1e-9): return
+    st.session_state.overhead_rates_map[s_key] = new_rate
+    st.session_state.df_main = calculate_dataframe(st.session_state.df_main, st.session_state.overhead_rates_map)
+
+def _apply_editor_changes():
+    """data_editorの差分（編集・追加・削除）だけをdf_mainに反映して再計算する"""
+    changes = st.session_state.editor
+    df = st.session_state.df_main
+    # edited_rows / deleted_rows の行番号はエディタに渡した df_main の並び順と一致する
+    for pos, row in changes['edited_rows'].items():
+        for col, val in row.items():
+            df.iat[int(pos), df.columns.get_loc(col)] = val
+    # 保存対象の行番号を記録する。削除があればその位置以降、追加があれば末尾の新しい行が対象
+    dirty = st.session_state.dirty_rows
+    if dirty is not None: dirty.update(int(pos) for pos in changes['edited_rows'])
+    first_shifted = min(changes['deleted_rows']) if changes['deleted_rows'] else len(df)
+    if changes['deleted_rows']:
+        df = df.drop(index=df.index[changes['deleted_rows']])
+    if changes['added_rows']:
+        df = append_rows(df, changes['added_rows'])
+    if dirty is not None: dirty.update(range(first_shifted, len(df)))
+    calc_rows = sorted(int(pos) for pos, row in changes['edited_rows'].items() if CALC_INPUT_COLS.intersection(row))
+    # 確認・備考など計算に関係しない列だけの編集なら、反映済みのdf_mainをそのまま使う
+    if not (changes['deleted_rows'] or changes['added_rows'] or calc_rows):
+        return
+    # 再計算（現在のレートマップを維持して適用）。編集だけなら変わった行、削除だけなら諸経費行だけを計算し直し、
+    # 追加行は列の型が揃っていないので全体を計算する
+    if changes['added_rows'] or (changes['deleted_rows'] and calc_rows): rows = None
+    else: rows = [] if changes['deleted_rows'] else calc_rows
+    st.session_state.df_main = calculate_dataframe(df.reset_index(drop=True), st.session_state.overhead_rates_map, rows)
+
 def main():
     st.set_page_config(layout="wide", page_title="見積コントロールセンター")
 
@@ -30,20 +118,44 @@ def main():
     if 'sheet_url' not in st.session_state: st.session_state.sheet_url = ""
     # 諸経費率を保存する辞書 {sort_key: rate}
     if 'overhead_rates_map' not in st.session_state: st.session_state.overhead_rates_map = {}
+    # 前回の読込・保存以降に変更された行番号（None はシート全体の書き直しが必要）と、シート上の列構成・行数
+    if 'dirty_rows' not in st.session_state: st.session_state.dirty_rows = None
+    if 'saved_cols' not in st.session_state: st.session_state.saved_cols = []
+    if 'saved_len' not in st.session_state: st.session_state.saved_len = 0
+    if 'save_future' not in st.session_state: st.session_state.save_future = None
 
     with st.sidebar:
         st.title("🛠️ 見積管理盤")
         
         with st.expander("📂 データ接続設定", expanded=(st.session_state.df_main is None)):
             input_url = st.text_input("スプレッドシートURL", value=st.session_state.sheet_url)
-            if st.button("データを読み込む"):
+            load_clicked = st.button("データを読み込む")
+            # シートを別の場所で更新した直後など、キャッシュ（5分）を待たずに取り直したいとき用
+            force_reload = st.button("🔄 キャッシュを使わず再読込")
+            if load_clicked or force_reload:
+                if force_reload: _load_data_cached.clear()
                 try:
-                    secrets = dict(st.secrets["gcp_service_account"])
-                    with st.spinner("シートから最新データを取得中..."):
-                        df, info = load_data(input_url, secrets)
-                        if df is not None:
+                    secrets = _service_account()
+                    requested_at = time.monotonic()
+                    with st.spinner("シートから最新データを取得中..." if force_reload else "シートを読み込み中..."):
+                        df, info, fetched_at = _load_data_cached(input_url, secrets)
+                        if df is None:
+                            # 失敗結果はキャッシュに残さない
+                            _load_data_cached.clear()
+                        else:
+                            st.session_state.saved_cols = df.columns.tolist()
+                            st.session_state.saved_len = len(df)
+                            st.session_state.dirty_rows = set()
+                            if fetched_at < requested_at:
+                                # キャッシュから返った内容は最大5分古く、その間にシート側が変わっているかもしれない。
+                                # 行位置での部分保存はせず、最初の保存はシートを消してから全体を書き直す
+                                st.session_state.dirty_rows = None
+                                st.session_state.saved_len = 0
                             if 'sort_key' not in df.columns:
                                 df['sort_key'] = [str(uuid.uuid4()) for _ in range(len(df))]
+                            # シートに無い表示列は読込時に一度だけ空列で補う
+                            missing = [c for c in DISPLAY_COLS if c not in df.columns]
+                            if missing: df = df.assign(**{c: "" for c in missing})
                             
                             st.session_state.info_dict = info
                             st.session_state.sheet_url = input_url
@@ -68,30 +180,17 @@ def main():
             overhead_rows = df_cur[df_cur['大項目'] == '諸経費']
             
             if not overhead_rows.empty:
-                rates_updated = False
-                
-                for _, row in overhead_rows.iterrows():
-                    s_key = str(row['sort_key'])
-                    name = str(row['名称'])
-                    spec = str(row['規格'])
-                    
+                for s_key, name, spec in overhead_rows[['sort_key', '名称', '規格']].astype(str).itertuples(index=False, name=None):
                     # 既存のレートがあれば取得、なければ0
                     current_rate = st.session_state.overhead_rates_map.get(s_key, 0.0)
                     
                     st.markdown(f"**{name}** <span style='font-size:0.8em; color:#666;'>({spec})</span>", unsafe_allow_html=True)
-                    new_rate = st.number_input(
+                    st.number_input(
                         f"諸経費率 (%)",
                         min_value=0.0, max_value=100.0, value=float(current_rate), step=0.5,
-                        key=f"rate_input_{s_key}"
+                        key=f"rate_input_{s_key}",
+                        on_change=_apply_rate_change, args=(s_key,)
                     )
-                    
-                    if new_rate != current_rate:
-                        st.session_state.overhead_rates_map[s_key] = new_rate
-                        rates_updated = True
-                
-                if rates_updated:
-                    st.session_state.df_main = calculate_dataframe(df_cur, st.session_state.overhead_rates_map)
-                    st.rerun()
                 
                 # 合計対象額（諸経費以外の合計）を表示（確認用）
                 base_total = df_cur[df_cur['大項目'] != '諸経費']['見積金額'].sum()
@@ -125,14 +224,30 @@ def main():
             st.markdown("---")
             st.subheader("操作メニュー")
             
-            if st.button("💾 シートに保存・更新", type="primary", use_container_width=True):
-                secrets = dict(st.secrets["gcp_service_account"])
-                with st.spinner("Google Sheetsへ書き込み中..."):
-                    # 保存時はレートマップの内容で計算された最新のDataFrameを保存
-                    if save_data(st.session_state.sheet_url, secrets, st.session_state.df_main):
-                        st.success("保存しました！")
-                    else:
-                        st.error("保存に失敗しました。")
+            saving = st.session_state.save_future is not None
+            if st.button("💾 シートに保存・更新", type="primary", use_container_width=True, disabled=saving):
+                secrets = _service_account()
+                # 保存時はレートマップの内容で計算された最新のDataFrameを保存
+                df_save = st.session_state.df_main
+                rows = None
+                if st.session_state.dirty_rows is not None and df_save.columns.tolist() == st.session_state.saved_cols:
+                    # 諸経費行は他の行の金額やレートで変わるので常に含める
+                    overhead_pos = (df_save['大項目'] == '諸経費').to_numpy().nonzero()[0]
+                    rows = sorted(r for r in st.session_state.dirty_rows.union(overhead_pos.tolist()) if r < len(df_save))
+                # 書き込みは別スレッドで行い、その間も編集を続けられるようにする。
+                # 編集は df_main をその場で書き換えるので、渡すのはコピー。以降の変更は新しい差分として記録する
+                st.session_state.save_future = _save_executor().submit(
+                    save_data, st.session_state.sheet_url, secrets, df_save.copy(), rows, st.session_state.saved_len)
+                st.session_state.dirty_rows = set()
+                st.session_state.saved_cols = df_save.columns.tolist()
+                st.session_state.saved_len = len(df_save)
+                saving = True
+            if saving:
+                _watch_save()
+            if 'save_msg' in st.session_state:
+                kind, msg = st.session_state.pop('save_msg')
+                if kind == 'success': st.success(msg)
+                else: st.error(msg)
 
             if st.button("📄 PDFを発行する", use_container_width=True):
                 params = {
@@ -148,8 +263,7 @@ def main():
                     'phone': st.session_state.info_dict.get('電話番号', ''),
                     'fax': st.session_state.info_dict.get('FAX番号', '')
                 }
-                gen = EstimatePDFGenerator(st.session_state.df_main, params)
-                pdf_data = gen.generate()
+                pdf_data = _build_pdf(st.session_state.df_main, tuple(params.items()))
                 fname = f"{params['date'].replace('/','')}_{params['client_name']}_{params['project_name']}.pdf"
                 st.download_button("📥 PDFをダウンロード", pdf_data, fname, "application/pdf", type="secondary")
 
@@ -175,30 +289,16 @@ def main():
             "sort_key": st.column_config.TextColumn("ID", disabled=True, width="small")
         }
 
-        display_cols = [
-            '確認', '大項目', '中項目', '名称', '規格', '数量', '単位',
-            'NET', '原単価', '掛率', '売単価', '見積金額', '(自)荒利率', '備考', 'sort_key'
-        ]
-        
-        for c in display_cols:
-            if c not in st.session_state.df_main.columns:
-                st.session_state.df_main[c] = ""
-
-        edited_df = st.data_editor(
-            st.session_state.df_main[display_cols],
+        # 変更はコールバックで差分だけ反映する（全体比較と再実行は不要）
+        st.data_editor(
+            st.session_state.df_main[DISPLAY_COLS],
             column_config=column_config,
             num_rows="dynamic",
             use_container_width=True,
             height=600,
-            key="editor"
+            key="editor",
+            on_change=_apply_editor_changes
         )
-
-        # エディタで変更があった場合
-        if not edited_df.equals(st.session_state.df_main[display_cols]):
-            # 再計算（現在のレートマップを維持して適用）
-            recalc_df = calculate_dataframe(edited_df, st.session_state.overhead_rates_map)
-            st.session_state.df_main = recalc_df
-            st.rerun()
             
     else:
         st.info("👈 左側のサイドバーからスプレッドシートのURLを入力してデータを読み込んでください。")
@@ -1,8 +1,11 @@
+import re
+import functools
 import pandas as pd
 import numpy as np
 import gspread
+from gspread.utils import absolute_range_name, fill_gaps
 from oauth2client.service_account import ServiceAccountCredentials
-from typing import Optional, Tuple, Dict, Any
+from typing import Optional, Tuple, Dict, Any, List
 
 # --- (既存の定数や関数はそのまま) ---
 # SHEET_NAME, INFO_SHEET_NAME, parse_amount, calculate_dataframe, get_gspread_client, load_data
@@ -11,66 +14,124 @@ from typing import Optional, Tuple, Dict, Any
 SHEET_NAME = "見積り集計表"
 INFO_SHEET_NAME = "現場情報"
 
+_AMOUNT_STRIP = re.compile(r'[¥,]')
+
+# calculate_dataframe が読む（または諸経費行で書き換える）入力列。これ以外の列の編集では再計算は不要
+CALC_INPUT_COLS = frozenset(['大項目', '数量', '原単価', '掛率', 'NET', '単位', 'sort_key'])
+
 def parse_amount(val: Any) -> float:
+    # 数値はそのまま返す（boolは従来どおり0扱いにするため除外）
+    if isinstance(val, (int, float)) and not isinstance(val, bool):
+        return 0.0 if val != val else float(val)
     try:
         if pd.isna(val) or val == '': return 0.0
-        return float(str(val).replace('¥', '').replace(',', ''))
+        return float(_AMOUNT_STRIP.sub('', str(val)))
     except (ValueError, TypeError):
         return 0.0
 
-def calculate_dataframe(df: pd.DataFrame, overhead_rates: Dict[str, float] = None) -> pd.DataFrame:
-    # （前回の修正版と同じコードを使用してください）
+def parse_amount_series(s: pd.Series) -> pd.Series:
+    """parse_amount の列版。¥とカンマを一括で除去して数値化する"""
+    # 計算済みの列はすでに数値なので、文字列化と除去を飛ばす（boolは従来どおり0扱い）
+    if pd.api.types.is_numeric_dtype(s) and not pd.api.types.is_bool_dtype(s):
+        return s.fillna(0.0).astype(float)
+    cleaned = s.astype(str).str.replace(_AMOUNT_STRIP, '', regex=True)
+    out = pd.to_numeric(cleaned, errors='coerce')
+    # 全角数字など to_numeric が読めない値だけ従来の変換に回す
+    miss = out.isna() & s.notna()
+    if miss.any():
+        out = out.astype(float)
+        out[miss] = cleaned[miss].map(parse_amount)
+    return out.fillna(0.0).astype(float)
+
+def append_rows(df: pd.DataFrame, added_rows: List[Dict[str, Any]]) -> pd.DataFrame:
+    """data_editor の added_rows を末尾に足す（行番号は振り直す）。
+    見出しの無い列が重複していても reindex しないよう、値は列位置で入れる"""
+    block = pd.DataFrame(np.full((len(added_rows), df.shape[1]), np.nan, dtype=object), columns=df.columns)
+    for i, row in enumerate(added_rows):
+        for col, val in row.items():
+            block.iat[i, df.columns.get_loc(col)] = val
+    return pd.concat([df, block.infer_objects()], ignore_index=True)
+
+def calculate_dataframe(df: pd.DataFrame, overhead_rates: Dict[str, float] = None, rows: Optional[List[int]] = None) -> pd.DataFrame:
+    """rows に行番号（0始まり）を渡すと、計算済みの df のうちその行だけ数値変換と単価・金額を計算し直す。
+    諸経費行と荒利は全行の合計に依存するので、rows の有無にかかわらず全体で計算する"""
     if overhead_rates is None: overhead_rates = {}
+    pos = slice(None) if rows is None else np.asarray(rows, dtype=np.intp)
+
+    def put(col, values):
+        if rows is None: df[col] = values
+        else: df.iloc[pos, df.columns.get_loc(col)] = values
+
     num_cols = ['数量', '原単価', '掛率', 'NET']
     for col in num_cols:
-        if col in df.columns: df[col] = df[col].apply(parse_amount)
+        if col in df.columns: put(col, parse_amount_series(df[col].iloc[pos]).to_numpy())
     
     overhead_mask = df['大項目'] == '諸経費'
     
-    # 通常行計算
-    df.loc[~overhead_mask, '売単価'] = (df.loc[~overhead_mask, '原単価'] * df.loc[~overhead_mask, '掛率']).astype(int)
-    df.loc[~overhead_mask, '見積金額'] = (df.loc[~overhead_mask, '数量'] * df.loc[~overhead_mask, '売単価']).astype(int)
-    df.loc[~overhead_mask, '実行金額'] = (df.loc[~overhead_mask, '数量'] * df.loc[~overhead_mask, '原単価']).astype(int)
-
-    base_total = df.loc[~overhead_mask, '見積金額'].sum()
-
-    # 諸経費行計算
-    for idx, row in df[overhead_mask].iterrows():
-        key = str(row.get('sort_key', ''))
-        rate = overhead_rates.get(key, 0.0)
-        calc_price = int(base_total * (rate / 100))
+    # 通常行計算（ndarrayでまとめて計算し、列ごとに1回で書き戻す。諸経費行は下で上書きする）
+    qty = df['数量'].to_numpy(np.float64)[pos]; cost = df['原単価'].to_numpy(np.float64)[pos]; rate = df['掛率'].to_numpy(np.float64)[pos]
+    # 積は1本の作業バッファに書き、int64への切り捨て（0方向）だけ新しい配列にする
+    buf = np.empty(len(qty))
+    sell = np.multiply(cost, rate, out=buf).astype(np.int64)
+    put('売単価', sell)
+    put('見積金額', np.multiply(qty, sell, out=buf).astype(np.int64))
+    put('実行金額', np.multiply(qty, cost, out=buf).astype(np.int64))
+
+    base_total = df['見積金額'].to_numpy()[~overhead_mask.to_numpy()].sum()
+
+    # 諸経費行計算（レートは sort_key で引き当て、列ごとに1回で書き込む）
+    if overhead_mask.any():
+        keys = df.loc[overhead_mask, 'sort_key'] if 'sort_key' in df.columns else pd.Series('', index=df.index[overhead_mask])
+        rates = keys.astype(str).map(overhead_rates).fillna(0.0).to_numpy(dtype=np.float64)
+        calc_price = (base_total * (rates / 100)).astype(np.int64)
         
-        df.at[idx, '数量'] = 1
-        df.at[idx, '単位'] = '式'
-        df.at[idx, '原単価'] = calc_price
-        df.at[idx, '掛率'] = 1.0
-        df.at[idx, '売単価'] = int(calc_price * 1.0)
-        df.at[idx, '見積金額'] = int(1 * calc_price * 1.0)
-        df.at[idx, '実行金額'] = int(1 * calc_price)
+        df.loc[overhead_mask, '数量'] = 1
+        df.loc[overhead_mask, '単位'] = '式'
+        df.loc[overhead_mask, '原単価'] = calc_price
+        df.loc[overhead_mask, '掛率'] = 1.0
+        df.loc[overhead_mask, '売単価'] = calc_price
+        df.loc[overhead_mask, '見積金額'] = calc_price
+        df.loc[overhead_mask, '実行金額'] = calc_price
 
     df['荒利金額'] = df['見積金額'] - df['実行金額']
-    df['(自)荒利率'] = df.apply(lambda x: x['荒利金額'] / x['見積金額'] if x['見積金額'] != 0 else 0, axis=1)
+    est = df['見積金額'].to_numpy(dtype=np.float64)
+    profit = df['荒利金額'].to_numpy(dtype=np.float64)
+    df['(自)荒利率'] = np.divide(profit, est, out=np.zeros(len(df)), where=est != 0)
     return df
 
-def get_gspread_client(secrets: Dict):
+@functools.lru_cache(maxsize=4)
+def _authorize(secrets_items: Tuple) -> gspread.Client:
     scope = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
-    creds = ServiceAccountCredentials.from_json_keyfile_dict(secrets, scope)
+    creds = ServiceAccountCredentials.from_json_keyfile_dict(dict(secrets_items), scope)
     return gspread.authorize(creds)
 
+def get_gspread_client(secrets: Dict):
+    # 認証済みクライアントはsecretsの内容ごとにプロセス内で使い回す（トークンの更新はgspread側で行われる）
+    return _authorize(tuple(sorted(secrets.items())))
+
+@functools.lru_cache(maxsize=8)
+def _open_workbook(secrets_items: Tuple, sheet_url: str) -> gspread.Spreadsheet:
+    return _authorize(secrets_items).open_by_url(sheet_url)
+
+def get_workbook(sheet_url: str, secrets: Dict) -> gspread.Spreadsheet:
+    """ブックのハンドルもURLごとに使い回し、読込・保存のたびにメタデータを取り直さない"""
+    return _open_workbook(tuple(sorted(secrets.items())), sheet_url)
+
 def load_data(sheet_url: str, secrets: Dict) -> Tuple[Optional[pd.DataFrame], Optional[Dict]]:
-    # (変更なし)
     try:
-        client = get_gspread_client(secrets)
-        wb = client.open_by_url(sheet_url)
-        sheet = wb.worksheet(SHEET_NAME)
-        data = sheet.get_all_values()
+        wb = get_workbook(sheet_url, secrets)
+        # 明細シートと現場情報シートを1回のbatchGetでまとめて取得する
+        resp = wb.values_batch_get([absolute_range_name(SHEET_NAME), absolute_range_name(INFO_SHEET_NAME)])
+        value_ranges = resp.get('valueRanges', [])
+        data = value_ranges[0].get('values', [])
         if len(data) < 2: return None, None
+        # APIの生の値は行末の空セルが省略されるので、get_all_values と同じく矩形に揃える
+        data = fill_gaps(data)
         df = pd.DataFrame(data[1:], columns=data[0])
-        info_sheet = wb.worksheet(INFO_SHEET_NAME)
-        info_data = info_sheet.get_all_values()
+        info_data = value_ranges[1].get('values', [])
         info_dict = {str(row[0]).strip(): str(row[1]).strip() for row in info_data if len(row) >= 2}
         if '確認' in df.columns:
-            df['確認'] = df['確認'].apply(lambda x: True if str(x).upper() == 'TRUE' else False)
+            df['確認'] = df['確認'].astype(str).str.upper().eq('TRUE')
         return df, info_dict
     except Exception as e:
         print(f"Error: {e}")
@@ -87,52 +148,68 @@ def _col_index_to_letter(n: int) -> str:
         string = chr(65 + remainder) + string
     return string
 
-def save_data(sheet_url: str, secrets: Dict, df: pd.DataFrame) -> bool:
+def save_data(sheet_url: str, secrets: Dict, df: pd.DataFrame, rows: Optional[List[int]] = None, n_saved: int = 0) -> bool:
+    """rows を渡すとその行番号（0始まり）だけを書き込む。None ならシート全体を書き直す
+    n_saved はシート上の現在の明細行数で、行を削除して短くなった分は空欄で上書きする"""
+    if rows is not None and not rows and n_saved <= len(df): return True
     try:
-        client = get_gspread_client(secrets)
-        wb = client.open_by_url(sheet_url)
-        sheet = wb.worksheet(SHEET_NAME)
+        wb = get_workbook(sheet_url, secrets)
         
-        # 保存用にコピー＆NaNを空文字に変換（エラー防止）
-        save_df = df.copy().fillna('')
+        # 書き込む値は1つのobject配列にまとめて作り、DataFrameの複製はしない（NaNは空文字にしてエラー防止）
+        cols = df.columns.tolist()
+        values = df.to_numpy(dtype=object, copy=True)
+        values[pd.isna(values)] = ''
+        col_idx = {name: i for i, name in enumerate(cols)}
         
         # Boolean変換
-        if '確認' in save_df.columns:
-            save_df['確認'] = save_df['確認'].apply(lambda x: 'TRUE' if x is True else 'FALSE')
+        if '確認' in col_idx:
+            values[:, col_idx['確認']] = np.where(df['確認'].eq(True), 'TRUE', 'FALSE')
         
         # --- 数式化ロジック ---
-        cols = save_df.columns.tolist()
         col_map = {name: _col_index_to_letter(i) for i, name in enumerate(cols)}
         
         req_cols = ['数量', '原単価', '掛率', '売単価', '見積金額', '実行金額', '荒利金額', '(自)荒利率']
         if all(c in col_map for c in req_cols):
-            for idx in range(len(save_df)):
-                row_num = idx + 2
-                
-                c_qty = col_map['数量']
-                c_cost = col_map['原単価']
-                c_rate = col_map['掛率']
-                c_sell = col_map['売単価']
-                c_est_amt = col_map['見積金額']
-                c_exec_amt = col_map['実行金額']
-                c_profit_amt = col_map['荒利金額']
-                
-                # 数式セット
-                save_df.at[idx, '売単価'] = f'=INT({c_cost}{row_num} * {c_rate}{row_num})'
-                save_df.at[idx, '実行金額'] = f'=INT({c_qty}{row_num} * {c_cost}{row_num})'
-                save_df.at[idx, '見積金額'] = f'=INT({c_qty}{row_num} * {c_sell}{row_num})'
-                save_df.at[idx, '荒利金額'] = f'={c_est_amt}{row_num} - {c_exec_amt}{row_num}'
-                save_df.at[idx, '(自)荒利率'] = f'=IFERROR({c_profit_amt}{row_num} / {c_est_amt}{row_num}, 0)'
-
-        data_to_write = [save_df.columns.values.tolist()] + save_df.values.tolist()
-        
-        sheet.clear()
+            # 列記号はループの外で一度だけ引き、数式は列ごとにリストでまとめて組み立てて置き換える
+            c_qty = col_map['数量']
+            c_cost = col_map['原単価']
+            c_rate = col_map['掛率']
+            c_sell = col_map['売単価']
+            c_est_amt = col_map['見積金額']
+            c_exec_amt = col_map['実行金額']
+            c_profit_amt = col_map['荒利金額']
+            row_nums = range(2, len(df) + 2)
+            
+            # 数式セット
+            values[:, col_idx['売単価']] = [f'=INT({c_cost}{n} * {c_rate}{n})' for n in row_nums]
+            values[:, col_idx['実行金額']] = [f'=INT({c_qty}{n} * {c_cost}{n})' for n in row_nums]
+            values[:, col_idx['見積金額']] = [f'=INT({c_qty}{n} * {c_sell}{n})' for n in row_nums]
+            values[:, col_idx['荒利金額']] = [f'={c_est_amt}{n} - {c_exec_amt}{n}' for n in row_nums]
+            values[:, col_idx['(自)荒利率']] = [f'=IFERROR({c_profit_amt}{n} / {c_est_amt}{n}, 0)' for n in row_nums]
+
+        if rows is not None:
+            # 変更行だけを1回のbatchUpdateで書き込む（シート上の行番号はヘッダー分ずれて +2）
+            last_col = _col_index_to_letter(len(cols) - 1)
+            data = [{'range': absolute_range_name(SHEET_NAME, f'A{r+2}:{last_col}{r+2}'), 'values': [values[r].tolist()]} for r in rows]
+            if n_saved > len(df):
+                blank = [[''] * len(cols) for _ in range(n_saved - len(df))]
+                data.append({'range': absolute_range_name(SHEET_NAME, f'A{len(df)+2}:{last_col}{n_saved+1}'), 'values': blank})
+            wb.values_batch_update({'valueInputOption': 'USER_ENTERED', 'data': data})
+            return True
+
+        data_to_write = [cols] + values.tolist()
+        if n_saved > len(df):
+            # 短くなった分は空欄で上書きし、clear() を挟まず1回の書き込みで済ませる
+            data_to_write += [[''] * len(cols) for _ in range(n_saved - len(df))]
+        elif not n_saved:
+            # 既存の行数が分からないときだけ先に消しておく
+            wb.values_clear(absolute_range_name(SHEET_NAME))
         
         # ★ここが修正ポイント: value_input_option='USER_ENTERED' を追加
-        sheet.update(
-            range_name='A1', 
-            values=data_to_write, 
-            value_input_option='USER_ENTERED'
+        wb.values_update(
+            absolute_range_name(SHEET_NAME, 'A1'),
+            params={'valueInputOption': 'USER_ENTERED'},
+            body={'values': data_to_write}
         )
         
         return True
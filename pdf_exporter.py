@@ -1,4 +1,7 @@
 import io
+import math
+import functools
+import numpy as np
 import pandas as pd
 from typing import Dict, Any
 from reportlab.pdfgen import canvas
@@ -7,7 +10,7 @@ from reportlab.lib.units import mm
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
 from reportlab.lib import colors
-from data_utils import parse_amount # 金額変換用に関数をインポート
+from data_utils import parse_amount_series # 金額変換用に関数をインポート
 
 # PDF用設定
 FONT_FILE = "NotoSerifJP-Regular.ttf" # ※同じディレクトリにフォントファイルを配置してください
@@ -21,6 +24,8 @@ class Style:
     COLOR_TEXT = colors.HexColor('#000000')
     COLOR_TOTAL = colors.HexColor('#B31A26')
     COLOR_ACCENT_BLUE = colors.HexColor('#26408C')
+    COLOR_COVER_BAND = colors.HexColor('#c2c9de')
+    COLOR_HEADER_BG = colors.Color(0.95, 0.95, 0.95)
     MARGIN_TOP = 35 * mm
     MARGIN_BOTTOM = 21 * mm
     ROW_HEIGHT = 7 * mm
@@ -31,6 +36,15 @@ class Style:
     INDENT_L3 = 4.5 * mm
     INDENT_ITEM = 6.0 * mm
 
+@functools.lru_cache(maxsize=1)
+def _register_font() -> str:
+    """フォント登録はプロセスで一度だけ行い、使用するフォント名を返す"""
+    try:
+        pdfmetrics.registerFont(TTFont(FONT_NAME, FONT_FILE))
+        return FONT_NAME
+    except Exception:
+        return FONT_NAME_FALLBACK
+
 def to_wareki(date_str: str) -> str:
     """西暦和暦変換（表示用）"""
     try:
@@ -50,24 +64,40 @@ def to_wareki(date_str: str) -> str:
 class EstimatePDFGenerator:
     def __init__(self, df: pd.DataFrame, params: Dict[str, str]):
         self.buffer = io.BytesIO()
-        self.c = canvas.Canvas(self.buffer, pagesize=landscape(A4))
+        self.c = canvas.Canvas(self.buffer, pagesize=landscape(A4), pageCompression=1)
         self.width, self.height = landscape(A4)
-        self.df = df
+        # 金額系の列は描画ループの前に一括で数値化しておく
+        self.df = df.assign(
+            _amt=self._parse_col(df, '見積金額'),
+            _qty=self._parse_col(df, '数量'),
+            _price=self._parse_col(df, '売単価'),
+        )
         self.params = params
+        # 表紙と鑑の両方で使うので和暦変換は一度だけ行う
+        self.date_wareki = to_wareki(params['date'])
         
-        # フォント登録試行
-        try:
-            pdfmetrics.registerFont(TTFont(FONT_NAME, FONT_FILE))
-            self.font = FONT_NAME
-        except:
-            self.font = FONT_NAME_FALLBACK
+        self.font = _register_font()
+        # _set_pen で最後に指定した塗り・線の色と線幅（None は不明）。saveState のたびに積んでおく
+        self._reset_pen(); self._pen_stack = []
 
         self.content_width = self.width - 30 * mm
         self._setup_columns()
-        self.total_grand = df['見積金額'].apply(parse_amount).sum()
+        self.total_grand = self.df['_amt'].sum()
         self.tax_amount = self.total_grand * 0.1
         self.final_total = self.total_grand + self.tax_amount
 
+    @staticmethod
+    def _parse_col(df: pd.DataFrame, col: str):
+        return parse_amount_series(df[col]) if col in df.columns else 0.0
+
+    def _str_col(self, col: str, strip: bool = False) -> np.ndarray:
+        """文字列列を描画用のndarrayとして取り出す（列が無い・NaNは空文字）"""
+        if col not in self.df.columns:
+            return np.full(len(self.df), '', dtype=object)
+        s = self.df[col].fillna('').astype(str)
+        if strip: s = s.str.strip()
+        return s.to_numpy()
+
     def _setup_columns(self):
         widths = {'name': 75*mm, 'spec': 67.5*mm, 'qty': 19*mm, 'unit': 12*mm, 'price': 27*mm, 'amt': 29*mm, 'rem': 0*mm}
         widths['rem'] = self.content_width - sum(widths.values())
@@ -82,7 +112,7 @@ class EstimatePDFGenerator:
 
     # --- 以下、描画メソッド (既存ロジックを維持) ---
     def _draw_bold_string(self, x, y, text, size, color=colors.black):
-        self.c.saveState()
+        self._save_state()
         self.c.setLineWidth(size * 0.03)
         t_obj = self.c.beginText(x, y)
         t_obj.setFont(self.font, size)
@@ -91,27 +121,55 @@ class EstimatePDFGenerator:
         t_obj.setTextRenderMode(2)
         t_obj.textOut(str(text))
         self.c.drawText(t_obj)
-        self.c.restoreState()
+        self._restore_state()
 
     def _draw_centered_bold(self, x, y, text, size, color=colors.black):
         tw = self.c.stringWidth(str(text), self.font, size)
         self._draw_bold_string(x - tw/2, y, text, size, color)
 
+    def _set_pen(self, fill=None, stroke=None, width=None):
+        """直前に _set_pen で指定した値と同じなら何も出力しない"""
+        if fill is not None and fill is not self._pen_fill: self.c.setFillColor(fill); self._pen_fill = fill
+        if stroke is not None and stroke is not self._pen_stroke: self.c.setStrokeColor(stroke); self._pen_stroke = stroke
+        if width is not None and width != self._pen_width: self.c.setLineWidth(width); self._pen_width = width
+
+    def _reset_pen(self):
+        """改ページ後や色・線幅を直接指定した後は状態が分からないので、次の _set_pen で必ず出力させる"""
+        self._pen_fill = self._pen_stroke = self._pen_width = None
+
+    def _save_state(self):
+        self.c.saveState(); self._pen_stack.append((self._pen_fill, self._pen_stroke, self._pen_width))
+
+    def _restore_state(self):
+        self.c.restoreState(); self._pen_fill, self._pen_stroke, self._pen_width = self._pen_stack.pop()
+
+    def _show_page(self):
+        self.c.showPage(); self._reset_pen()
+
+    def _text_cell(self, t, x, y, text, size, align='left'):
+        """テキストオブジェクト上に1セル分を配置する（right/centreはstringWidthで位置を合わせる）"""
+        if align != 'left':
+            tw = self.c.stringWidth(text, self.font, size)
+            x -= tw if align == 'right' else tw / 2
+        t.setTextOrigin(x, y)
+        t.textOut(text)
+
     def _draw_grid(self, y_top, y_bottom):
-        self.c.saveState()
+        self._save_state()
         self.c.setLineWidth(0.5)
+        # 縦線(グレー)と横線(黒)をそれぞれ1パスでまとめて描画する
+        xs = list(self.col_x.values()) + [self.right_edge]
         self.c.setStrokeColor(colors.grey)
-        for k in self.col_x:
-            self.c.line(self.col_x[k], y_top, self.col_x[k], y_bottom)
-        self.c.line(self.right_edge, y_top, self.right_edge, y_bottom)
+        self.c.lines([(x, y_top, x, y_bottom) for x in xs])
+        ys = []
         curr = y_top
         while curr > y_bottom - 0.1:
-            self.c.setStrokeColor(colors.black)
-            self.c.line(Style.X_BASE, curr, self.right_edge, curr)
+            ys.append(curr)
             curr -= Style.ROW_HEIGHT
+        ys.append(y_bottom)
         self.c.setStrokeColor(colors.black)
-        self.c.line(Style.X_BASE, y_bottom, self.right_edge, y_bottom)
-        self.c.restoreState()
+        self.c.lines([(Style.X_BASE, y, self.right_edge, y) for y in ys])
+        self._restore_state()
 
     def _draw_page_header(self, p_num, title):
         hy = self.height - 20 * mm
@@ -125,7 +183,7 @@ class EstimatePDFGenerator:
         self.c.drawRightString(self.right_edge, hy, self.params['company_name'])
         self.c.drawCentredString(self.width/2, 10*mm, f"- {p_num} -")
         grid_y = self.y_start
-        self.c.setFillColor(colors.Color(0.95, 0.95, 0.95))
+        self.c.setFillColor(Style.COLOR_HEADER_BG)
         self.c.rect(Style.X_BASE, grid_y, self.right_edge - Style.X_BASE, Style.HEADER_HEIGHT, fill=1, stroke=0)
         self.c.setFillColor(colors.black)
         self.c.setFont(self.font, 10)
@@ -138,9 +196,9 @@ class EstimatePDFGenerator:
         self.c.rect(Style.X_BASE, grid_y, self.right_edge - Style.X_BASE, Style.HEADER_HEIGHT, stroke=1, fill=0)
         self.c.setLineWidth(0.5)
         self.c.setStrokeColor(colors.grey)
-        for k in self.col_x:
-            self.c.line(self.col_x[k], grid_y + Style.HEADER_HEIGHT, self.col_x[k], grid_y)
-        self.c.line(self.right_edge, grid_y + Style.HEADER_HEIGHT, self.right_edge, grid_y)
+        xs = list(self.col_x.values()) + [self.right_edge]
+        self.c.lines([(x, grid_y + Style.HEADER_HEIGHT, x, grid_y) for x in xs])
+        self._reset_pen()
 
     def draw_cover(self):
         # 表紙描画 (省略せずそのまま実装)
@@ -148,13 +206,13 @@ class EstimatePDFGenerator:
         lw = 180*mm
         lx = (self.width - lw)/2
         ly = self.height - 57*mm 
-        self.c.saveState()
+        self._save_state()
         self.c.setFillAlpha(0.2)
-        self.c.setStrokeColor(colors.HexColor('#c2c9de'))
+        self.c.setStrokeColor(Style.COLOR_COVER_BAND)
         self.c.setLineWidth(14)
         self.c.line(lx, ly, lx+lw, ly)
-        self.c.restoreState()
-        self.c.saveState()
+        self._restore_state()
+        self._save_state()
         t = self.c.beginText()
         t.setFont(self.font, 45)
         t.setFillColor(Style.COLOR_ACCENT_BLUE)
@@ -163,14 +221,14 @@ class EstimatePDFGenerator:
         t.setTextOrigin(self.width/2 - tw/2, self.height - 55*mm)
         t.textOut(title_text)
         self.c.drawText(t)
-        self.c.restoreState()
+        self._restore_state()
         self._draw_centered_bold(self.width/2, self.height - 110*mm, f"{self.params['client_name']}", 32)
         self.c.setLineWidth(1)
         self.c.line(self.width/2 - 60*mm, self.height - 112*mm, self.width/2 + 60*mm, self.height - 112*mm)
         self._draw_centered_bold(self.width/2, self.height - 140*mm, f"{self.params['project_name']}", 24)
         self.c.setLineWidth(0.5)
         self.c.line(self.width/2 - 50*mm, self.height - 142*mm, self.width/2 + 50*mm, self.height - 142*mm)
-        wareki = to_wareki(self.params['date'])
+        wareki = self.date_wareki
         self.c.setFont(self.font, 14)
         self.c.drawString(40*mm, 50*mm, wareki)
         x_co = self.width - 100*mm
@@ -183,7 +241,7 @@ class EstimatePDFGenerator:
         self.c.drawString(x_co, y_co - 26*mm, f"TEL: {self.params['phone']}")
         if self.params['fax']:
             self.c.drawString(x_co + 40*mm, y_co - 26*mm, f"FAX: {self.params['fax']}")
-        self.c.showPage()
+        self._show_page()
 
     def draw_summary(self):
         # 鑑（サマリー）描画
@@ -228,20 +286,20 @@ class EstimatePDFGenerator:
         self.c.setFont(self.font, 11); self.c.drawString(x_co, y_co + 10*mm, f"代表取締役   {self.params['ceo']}")
         self.c.setFont(self.font, 10); self.c.drawString(x_co, y_co + 5*mm, f"〒 {self.params['address']}")
         self.c.drawString(x_co, y_co, f"TEL {self.params['phone']}  FAX {self.params['fax']}")
-        wareki = to_wareki(self.params['date'])
+        wareki = self.date_wareki
         self.c.setFont(self.font, 12)
         self.c.drawString(self.width - 80*mm, box_top + 5*mm, wareki)
-        self.c.showPage()
+        self._show_page()
 
     def draw_total_summary(self, p_num):
         # 集計表（L1レベル）
         self._draw_page_header(p_num, "見 積 総 括 表")
         self._draw_grid(self.y_start, Style.MARGIN_BOTTOM - Style.ROW_HEIGHT)
         y = self.y_start
-        l1_summary = self.df.groupby('大項目', sort=False)['見積金額'].apply(lambda x: x.apply(parse_amount).sum()).reset_index()
+        l1_summary = self.df.groupby('大項目', sort=False)['_amt'].sum().reset_index()
         for _, row in l1_summary.iterrows():
             l1_name = row['大項目']
-            amount = row['見積金額']
+            amount = row['_amt']
             if not l1_name: continue
             self._draw_bold_string(self.col_x['name'] + Style.INDENT_L1, y-5*mm, f"■ {l1_name}", 10, Style.COLOR_L1)
             self.c.setFont(self.font, 10)
@@ -259,47 +317,35 @@ class EstimatePDFGenerator:
             self.c.setFillColor(Style.COLOR_TOTAL)
             self.c.drawRightString(self.col_x['amt'] + self.col_widths['amt'] - 2*mm, y-5*mm, f"{int(val):,}")
             y -= Style.ROW_HEIGHT
-        self.c.showPage()
+        self._show_page()
         return p_num + 1
 
     def draw_breakdown_pages(self, p_num):
         # 内訳明細（L1-L2集計）
-        raw_rows = self.df.to_dict('records')
-        breakdown = {}
-        seen_l1 = []
-        seen_l2_by_l1 = {}
-        for row in raw_rows:
-            l1 = str(row.get('大項目', '')).strip()
-            l2 = str(row.get('中項目', '')).strip()
-            amt = parse_amount(row.get('見積金額', 0))
-            if not l1: continue
-            if l1 not in seen_l1:
-                seen_l1.append(l1)
-                seen_l2_by_l1[l1] = []
-            
-            # 修正: 中項目(l2)が空でもリストに追加して、後で処理できるようにする
-            if l2 not in seen_l2_by_l1[l1]:
-                seen_l2_by_l1[l1].append(l2)
-                
-            if l1 not in breakdown: breakdown[l1] = {'items': {}, 'total': 0}
-            # 空のキーも辞書に登録する
-            if l2 not in breakdown[l1]['items']: breakdown[l1]['items'][l2] = 0
-            breakdown[l1]['items'][l2] += amt
-            breakdown[l1]['total'] += amt
+        l1_arr = self._str_col('大項目', strip=True)
+        l2_arr = self._str_col('中項目', strip=True)
+        tbl = pd.DataFrame({'l1': l1_arr, 'l2': l2_arr, 'amt': self.df['_amt'].to_numpy()})
+        tbl = tbl[tbl['l1'] != '']
+        # 集計はgroupby(sort=False)でまとめて行う。出現順はdictの挿入順で保持する
+        # （中項目が空のキーも登録する）
+        l1_sums = tbl.groupby('l1', sort=False)['amt'].sum()
+        l2_sums = tbl.groupby(['l1', 'l2'], sort=False)['amt'].sum()
+        breakdown = {l1: {'items': {}, 'total': total} for l1, total in l1_sums.items()}
+        for (l1, l2), amt in l2_sums.items():
+            breakdown[l1]['items'][l2] = amt
 
         self._draw_page_header(p_num, "内 訳 明 細 書 (集計)")
         self._draw_grid(self.y_start, Style.MARGIN_BOTTOM - Style.ROW_HEIGHT)
         y = self.y_start
         is_first = True
         
-        for l1 in seen_l1:
-            data = breakdown[l1]
-            sorted_l2 = seen_l2_by_l1[l1]
+        for l1, data in breakdown.items():
+            sorted_l2 = list(data['items'])
             spacer = 1 if not is_first else 0
             rows_needed = spacer + 1 + len(sorted_l2) + 1
             rows_left = int((y - Style.MARGIN_BOTTOM) / Style.ROW_HEIGHT)
             if rows_needed > rows_left:
-                self.c.showPage()
+                self._show_page()
                 p_num += 1
                 self._draw_page_header(p_num, "内 訳 明 細 書 (集計)")
                 self._draw_grid(self.y_start, Style.MARGIN_BOTTOM - Style.ROW_HEIGHT)
@@ -325,54 +371,52 @@ class EstimatePDFGenerator:
             self.c.drawRightString(self.col_x['amt'] + self.col_widths['amt'] - 2*mm, y-5*mm, f"{int(data['total']):,}")
             y -= Style.ROW_HEIGHT
             is_first = False
-        self.c.showPage()
+        self._show_page()
         return p_num + 1
 
     def draw_detail_pages(self, p_num):
         # 詳細ページ描画
+        # 出現順は data_tree の挿入順で保持する（中項目が空でもキーとして登録）
+        # 行dictを作らず、列ごとのndarrayを行番号で参照する
+        l1_arr = self._str_col('大項目', strip=True); l2_arr = self._str_col('中項目', strip=True)
+        l3_arr = self._str_col('小項目', strip=True); l4_arr = self._str_col('部分項目', strip=True)
+        name_arr = self._str_col('名称'); spec_arr = self._str_col('規格')
+        unit_arr = self._str_col('単位'); rem_arr = self._str_col('備考')
+        amt_arr = self.df['_amt'].to_numpy(); qty_arr = self.df['_qty'].to_numpy(); price_arr = self.df['_price'].to_numpy()
+        # 明細の数値表示はループ前にまとめて整形しておく（0は空欄）
+        qty_str = np.where(qty_arr != 0, pd.Series(qty_arr).map('{:,.2f}'.format).to_numpy(), '')
+        price_str = np.where(price_arr != 0, pd.Series(price_arr.astype(np.int64)).map('{:,}'.format).to_numpy(), '')
+        amt_str = np.where(amt_arr != 0, pd.Series(amt_arr.astype(np.int64)).map('{:,}'.format).to_numpy(), '')
         data_tree = {}
-        seen_l1 = []
-        seen_l2_by_l1 = {}
-        for row in self.df.to_dict('records'):
-            l1 = str(row.get('大項目', '')).strip(); l2 = str(row.get('中項目', '')).strip()
-            l3 = str(row.get('小項目', '')).strip(); l4 = str(row.get('部分項目', '')).strip()
+        for r, (l1, l2, name) in enumerate(zip(l1_arr, l2_arr, name_arr)):
             if not l1: continue
-            if l1 not in seen_l1:
-                seen_l1.append(l1); seen_l2_by_l1[l1] = []
-            
-            # 修正: 中項目(l2)が空でもリストに追加
-            if l2 not in seen_l2_by_l1[l1]: seen_l2_by_l1[l1].append(l2)
-            
             if l1 not in data_tree: data_tree[l1] = {}
             if l2 not in data_tree[l1]: data_tree[l1][l2] = []
-            item = row.copy()
-            item.update({
-                'amt_val': parse_amount(row.get('見積金額', 0)),
-                'qty_val': parse_amount(row.get('数量', 0)),
-                'price_val': parse_amount(row.get('売単価', 0)),
-                'l3': l3, 'l4': l4
-            })
-            if item.get('名称'): data_tree[l1][l2].append(item)
+            if name: data_tree[l1][l2].append(r)
+        # L1/L2計は名称のある行だけを対象に groupby で先に求めておく
+        tbl = pd.DataFrame({'l1': l1_arr, 'l2': l2_arr, 'amt': amt_arr})
+        tbl = tbl[(tbl['l1'] != '') & (name_arr != '')]
+        l1_totals = tbl.groupby('l1', sort=False)['amt'].sum().to_dict()
+        l2_totals = tbl.groupby(['l1', 'l2'], sort=False)['amt'].sum().to_dict()
 
         self._draw_page_header(p_num, "内 訳 明 細 書 (詳細)")
         self._draw_grid(self.y_start, Style.MARGIN_BOTTOM - Style.ROW_HEIGHT)
         y = self.y_start
         is_first = True
 
-        for l1 in seen_l1:
-            l2_dict = data_tree[l1]
-            l1_total = sum([sum([i['amt_val'] for i in items]) for items in l2_dict.values()])
-            sorted_l2 = seen_l2_by_l1[l1]
+        for l1, l2_dict in data_tree.items():
+            l1_total = l1_totals.get(l1, 0)
+            sorted_l2 = list(l2_dict)
             if not is_first:
                 if y <= Style.MARGIN_BOTTOM + Style.ROW_HEIGHT * 2:
-                    self.c.showPage(); p_num += 1
+                    self._show_page(); p_num += 1
                     self._draw_page_header(p_num, "内 訳 明 細 書 (詳細)")
                     self._draw_grid(self.y_start, Style.MARGIN_BOTTOM - Style.ROW_HEIGHT)
                     y = self.y_start
                 else:
                     y -= Style.ROW_HEIGHT
             if y <= Style.MARGIN_BOTTOM + Style.ROW_HEIGHT:
-                self.c.showPage(); p_num += 1
+                self._show_page(); p_num += 1
                 self._draw_page_header(p_num, "内 訳 明 細 書 (詳細)")
                 self._draw_grid(self.y_start, Style.MARGIN_BOTTOM - Style.ROW_HEIGHT)
                 y = self.y_start
@@ -382,7 +426,7 @@ class EstimatePDFGenerator:
             
             for i_l2, l2 in enumerate(sorted_l2):
                 items = l2_dict[l2]
-                l2_total = sum([i['amt_val'] for i in items])
+                l2_total = l2_totals.get((l1, l2), 0)
                 rows_to_draw = []
                 
                 # 修正: 中項目(l2)がある場合のみヘッダー追加
@@ -391,8 +435,8 @@ class EstimatePDFGenerator:
                 
                 curr_l3 = ""; curr_l4 = ""; sub_l3 = 0; sub_l4 = 0
                 item_rows = []
-                for itm in items:
-                    l3 = itm['l3']; l4 = itm['l4']; amt = itm['amt_val']
+                for r in items:
+                    l3 = l3_arr[r]; l4 = l4_arr[r]; amt = amt_arr[r]
                     l3_chg = (l3 and l3 != curr_l3); l4_chg = (l4 and l4 != curr_l4)
                     if curr_l4 and (l4_chg or l3_chg):
                         item_rows.append({'type': 'footer_l4', 'label': f"【{curr_l4}】 小計", 'amt': sub_l4})
@@ -405,7 +449,7 @@ class EstimatePDFGenerator:
                     if l3_chg: item_rows.append({'type': 'header_l3', 'label': f"・ {l3}"}); curr_l3 = l3
                     if l4_chg: item_rows.append({'type': 'header_l4', 'label': f"【{l4}】"}); curr_l4 = l4
                     sub_l3 += amt; sub_l4 += amt
-                    item_rows.append({'type': 'item', 'data': itm})
+                    item_rows.append({'type': 'item', 'row': r})
                 if curr_l4: item_rows.append({'type': 'footer_l4', 'label': f"【{curr_l4}】 小計", 'amt': sub_l4})
                 if curr_l3: item_rows.append({'type': 'footer_l3', 'label': f"【{curr_l3} 小計】", 'amt': sub_l3})
                 rows_to_draw.extend(item_rows)
@@ -426,7 +470,7 @@ class EstimatePDFGenerator:
                     itype = b['type']
                     force_stay = (itype == 'footer_l1')
                     if y - Style.ROW_HEIGHT < Style.MARGIN_BOTTOM - 0.1 and not force_stay:
-                        self.c.showPage(); p_num += 1
+                        self._show_page(); p_num += 1
                         self._draw_page_header(p_num, "内 訳 明 細 書 (詳細)")
                         self._draw_grid(self.y_start, Style.MARGIN_BOTTOM - Style.ROW_HEIGHT)
                         y = self.y_start
@@ -449,7 +493,8 @@ class EstimatePDFGenerator:
                         req_rows = 1 if itype == 'footer_l2' and is_last_l2 else 0
                         target_y = Style.MARGIN_BOTTOM + (req_rows * Style.ROW_HEIGHT)
                         if y > target_y + 0.1:
-                            while y > target_y + 0.1: y -= Style.ROW_HEIGHT
+                            # 空行ぶんを1行ずつ送らず、必要な行数をまとめて送る
+                            y -= math.ceil((y - target_y - 0.1) / Style.ROW_HEIGHT) * Style.ROW_HEIGHT
                     
                     if itype == 'header_l2':
                         self._draw_bold_string(self.col_x['name']+Style.INDENT_L2, y-5*mm, b['label'], 10, Style.COLOR_L2)
@@ -461,34 +506,39 @@ class EstimatePDFGenerator:
                         self._draw_bold_string(self.col_x['name']+Style.INDENT_ITEM, y-5*mm, b['label'], 9, colors.black)
                         cur_l4_lbl = b['label']
                     elif itype == 'item':
-                        d = b['data']; self.c.setFont(self.font, 9); self.c.setFillColor(colors.black)
-                        self.c.drawString(self.col_x['name']+Style.INDENT_ITEM, y-5*mm, d.get('名称',''))
-                        self.c.setFont(self.font, 8); self.c.drawString(self.col_x['spec']+1*mm, y-5*mm, d.get('規格',''))
-                        self.c.setFont(self.font, 9)
-                        if d['qty_val']: self.c.drawRightString(self.col_x['qty']+self.col_widths['qty']-2*mm, y-5*mm, f"{d['qty_val']:,.2f}")
-                        self.c.drawCentredString(self.col_x['unit']+self.col_widths['unit']/2, y-5*mm, d.get('単位',''))
-                        if d['price_val']: self.c.drawRightString(self.col_x['price']+self.col_widths['price']-2*mm, y-5*mm, f"{int(d['price_val']):,}")
-                        if d['amt_val']: self.c.drawRightString(self.col_x['amt']+self.col_widths['amt']-2*mm, y-5*mm, f"{int(d['amt_val']):,}")
-                        self.c.setFont(self.font, 8); self.c.drawString(self.col_x['rem']+1*mm, y-5*mm, d.get('備考',''))
+                        # 1行分のセルは1つのテキストオブジェクト(BT...ET)にまとめて描画する
+                        # 空のセルは何も出力しない（規格・備考が空なら8ptのフォント指定も省く）
+                        r = b['row']; ty = y-5*mm; self._set_pen(fill=colors.black)
+                        t = self.c.beginText(); t.setFont(self.font, 9)
+                        self._text_cell(t, self.col_x['name']+Style.INDENT_ITEM, ty, name_arr[r], 9)
+                        if qty_str[r]: self._text_cell(t, self.col_x['qty']+self.col_widths['qty']-2*mm, ty, qty_str[r], 9, 'right')
+                        if unit_arr[r]: self._text_cell(t, self.col_x['unit']+self.col_widths['unit']/2, ty, unit_arr[r], 9, 'centre')
+                        if price_str[r]: self._text_cell(t, self.col_x['price']+self.col_widths['price']-2*mm, ty, price_str[r], 9, 'right')
+                        if amt_str[r]: self._text_cell(t, self.col_x['amt']+self.col_widths['amt']-2*mm, ty, amt_str[r], 9, 'right')
+                        if spec_arr[r] or rem_arr[r]:
+                            t.setFont(self.font, 8)
+                            if spec_arr[r]: self._text_cell(t, self.col_x['spec']+1*mm, ty, spec_arr[r], 8)
+                            if rem_arr[r]: self._text_cell(t, self.col_x['rem']+1*mm, ty, rem_arr[r], 8)
+                        self.c.drawText(t)
                     elif itype == 'footer_l4':
                         self._draw_bold_string(self.col_x['name']+Style.INDENT_ITEM, y-5*mm, b['label'], 9, colors.black)
                         self.c.setFont(self.font, 9); self.c.drawRightString(self.col_x['amt']+self.col_widths['amt']-2*mm, y-5*mm, f"{int(b['amt']):,}")
                         cur_l4_lbl = None
                     elif itype == 'footer_l3':
                         self._draw_bold_string(self.col_x['name']+Style.INDENT_L3, y-5*mm, b['label'], 9, Style.COLOR_L3)
-                        self.c.setFont(self.font, 9); self.c.setFillColor(Style.COLOR_L3)
+                        self.c.setFont(self.font, 9); self._set_pen(fill=Style.COLOR_L3)
                         self.c.drawRightString(self.col_x['amt']+self.col_widths['amt']-2*mm, y-5*mm, f"{int(b['amt']):,}")
                         cur_l3_lbl = None
                     elif itype == 'footer_l2':
                         self._draw_bold_string(self.col_x['name']+Style.INDENT_L2, y-5*mm, b['label'], 10, Style.COLOR_L2)
-                        self.c.setFont(self.font, 10); self.c.setFillColor(Style.COLOR_L2)
+                        self.c.setFont(self.font, 10); self._set_pen(fill=Style.COLOR_L2)
                         self.c.drawRightString(self.col_x['amt']+self.col_widths['amt']-2*mm, y-5*mm, f"{int(b['amt']):,}")
-                        self.c.setLineWidth(1); self.c.setStrokeColor(Style.COLOR_L2); self.c.line(Style.X_BASE, y, self.right_edge, y)
+                        self._set_pen(stroke=Style.COLOR_L2, width=1); self.c.line(Style.X_BASE, y, self.right_edge, y)
                     elif itype == 'footer_l1':
                         self._draw_bold_string(self.col_x['name']+Style.INDENT_L1, y-5*mm, b['label'], 10, Style.COLOR_L1)
-                        self.c.setFont(self.font, 10); self.c.setFillColor(Style.COLOR_L1)
+                        self.c.setFont(self.font, 10); self._set_pen(fill=Style.COLOR_L1)
                         self.c.drawRightString(self.col_x['amt']+self.col_widths['amt']-2*mm, y-5*mm, f"{int(b['amt']):,}")
-                        self.c.setLineWidth(1); self.c.setStrokeColor(Style.COLOR_L1); self.c.line(Style.X_BASE, y, self.right_edge, y)
+                        self._set_pen(stroke=Style.COLOR_L1, width=1); self.c.line(Style.X_BASE, y, self.right_edge, y)
                     y -= Style.ROW_HEIGHT
         return p_num
 
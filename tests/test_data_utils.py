@@ -0,0 +1,26 @@
+import numpy as np
+import pandas as pd
+
+from data_utils import append_rows, calculate_dataframe
+
+
+def test_append_rows_with_duplicate_blank_columns():
+    # 見出しの無い列が2つ以上あるシートは列名 '' が重複する
+    df = pd.DataFrame([['A', '工事', 2.0, 'x', 'y']], columns=['大項目', '名称', '数量', '', ''])
+    out = append_rows(df, [{'名称': '追加', '数量': 3}, {'大項目': 'B'}])
+    assert out.columns.tolist() == ['大項目', '名称', '数量', '', '']
+    assert out.index.tolist() == [0, 1, 2]
+    assert out.iloc[1, 1:3].tolist() == ['追加', 3.0]
+    assert pd.isna(out.iloc[1, 0])
+    assert out.iloc[2, 0] == 'B'
+    assert out.iloc[1:, 3:].isna().all().all()
+    assert out['数量'].dtype == np.float64
+
+
+def test_append_rows_then_recalculate():
+    df = pd.DataFrame({'大項目': ['A'], '数量': [1.0], '原単価': [100.0], '掛率': [1.2], '': ['']})
+    df = calculate_dataframe(df)
+    df = append_rows(df, [{'大項目': 'A', '数量': 2, '原単価': 50, '掛率': 1.5}])
+    df = calculate_dataframe(df)
+    assert df['売単価'].tolist() == [120, 75]
+    assert df['見積金額'].tolist() == [120, 150]